@@ -17,14 +17,15 @@ Output:
 
 import os
 import sys
-import json
+import io
+import hashlib
 import argparse
-from collections import defaultdict
+from array import array
 
 import numpy as np
+import orjson
 import pandas as pd
 import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
 from matplotlib.colors import Normalize
 from PIL import Image
 
@@ -42,125 +43,293 @@ def parse_args():
                     help="Output directory (default: ./output)")
     p.add_argument("--thumbnail-size", type=int, default=2048,
                     help="Max thumbnail dimension in pixels (default: 2048)")
+    p.add_argument("--base-tile-size", type=int, default=None,
+                    help="Bin samples at this tile size, then aggregate up to "
+                         "--tile-size (must divide it; default: --tile-size)")
+    p.add_argument("--cache-dir", default=None,
+                    help="Cache the base-size dwell grid here; later runs on "
+                         "the same session skip loading it")
     return p.parse_args()
 
 
+# Byte markers of a compact saccade gaze record, as written by GazeLogger
+GAZE_MARK = b'"type":"gaze"'
+SACCADE_MARK = b'"sac":true'
+
+
+def open_session(path):
+    # type: (str) -> io.BufferedIOBase
+    """Open a session log for binary line iteration, decompressing .zst."""
+    if path.endswith(".zst"):
+        import zstandard   # optional; only needed for .zst sessions
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+        return io.BufferedReader(reader, buffer_size=1024 * 1024)
+    return open(path, "rb")
+
+
 def load_session(path):
     # type: (str) -> tuple
-    """Load JSONL session file. Returns (header_dict, list_of_gaze_dicts)."""
+    """
+    Load a session: a JSONL file (plain, or zstd-compressed with a .zst
+    suffix), or an Arrow gaze stream (.arrow) next to its JSONL sidecar.
+
+    Returns (header_dict, samples, list_of_event_dicts), where samples is a
+    dict of NumPy columns "wx", "wy", "fid" — gaze records are packed into
+    typed arrays while parsing instead of being kept as dicts. Saccade
+    samples never count toward dwell, so they are only tallied (in
+    samples["saccades"]); compact records are recognised before decoding.
+    """
+    if path.endswith(".arrow"):
+        header, samples, events = load_arrow_session(path)
+    else:
+        header, samples, events = parse_jsonl(path)
+
+    if header is None:
+        print("[warn] No session header found in {}".format(path))
+        header = {}
+
+    print("[analyze] Loaded {} gaze samples, {} events".format(
+        len(samples["wx"]) + samples["saccades"], len(events)
+    ))
+    return header, samples, events
+
+
+def parse_jsonl(path):
+    # type: (str) -> tuple
+    """Parse a JSONL session into (header_or_None, samples, events)."""
     header = None
-    gaze_records = []
     events = []
 
-    with open(path, "r", encoding="utf-8") as f:
+    wx = array("d")
+    wy = array("d")
+    fid = array("i")
+    saccades = 0
+
+    with open_session(path) as f:
         for line_num, line in enumerate(f, 1):
             line = line.strip()
             if not line:
                 continue
+            if SACCADE_MARK in line and GAZE_MARK in line:
+                saccades += 1
+                continue
             try:
-                obj = json.loads(line)
-            except json.JSONDecodeError:
+                obj = orjson.loads(line)
+            except orjson.JSONDecodeError:
                 print("[warn] Skipping malformed line {}".format(line_num))
                 continue
 
             rec_type = obj.get("type", "")
 
-            if rec_type == "session_header":
+            if rec_type == "gaze":
+                if obj.get("sac", False):
+                    saccades += 1
+                    continue
+                wx.append(obj.get("wx", 0))
+                wy.append(obj.get("wy", 0))
+                fid.append(obj.get("fid", -1))
+            elif rec_type == "session_header":
                 header = obj
-            elif rec_type == "gaze":
-                gaze_records.append(obj)
             else:
                 events.append(obj)
 
-    if header is None:
-        print("[warn] No session header found in {}".format(path))
-        header = {}
+    samples = {
+        "wx": np.frombuffer(wx, dtype=np.float64),
+        "wy": np.frombuffer(wy, dtype=np.float64),
+        "fid": np.frombuffer(fid, dtype=np.intc),
+        "saccades": saccades,
+    }
+    return header, samples, events
 
-    print("[analyze] Loaded {} gaze samples, {} events".format(
-        len(gaze_records), len(events)
-    ))
-    return header, gaze_records, events
 
-
-def compute_dwell_map(gaze_records, tile_size, slide_width, slide_height):
-    # type: (list, int, int, int) -> pd.DataFrame
+def load_arrow_session(path):
+    # type: (str) -> tuple
     """
-    Compute per-tile dwell time and fixation count.
-
-    Each gaze sample contributes (1/sampling_rate) seconds of dwell time
-    to the tile it falls in. Saccade samples are excluded.
+    Read gaze columns from an Arrow IPC stream written by the simulator's
+    --log-format arrow, and header/events from the sidecar JSONL.
+    Needs pyarrow, imported here so JSONL sessions don't.
     """
-    tile_dwell = defaultdict(float)      # (col, row) -> total ms
-    tile_fixations = defaultdict(set)    # (col, row) -> set of fixation IDs
-    tile_sample_count = defaultdict(int) # (col, row) -> count
+    import pyarrow as pa
 
-    max_col = (slide_width + tile_size - 1) // tile_size
-    max_row = (slide_height + tile_size - 1) // tile_size
+    sidecar = path[:-len(".arrow")] + ".jsonl"
+    if os.path.isfile(sidecar):
+        header, _, events = parse_jsonl(sidecar)
+    else:
+        print("[warn] Sidecar not found: {}".format(sidecar))
+        header, events = None, []
 
-    skipped_saccade = 0
-    skipped_oob = 0
-    counted = 0
+    with pa.OSFile(path, "rb") as f:
+        table = pa.ipc.open_stream(f).read_all()
 
-    for rec in gaze_records:
-        if rec.get("sac", False):
-            skipped_saccade += 1
-            continue
+    sac = table.column("sac").to_numpy()
+    fix = ~sac
+    samples = {
+        "wx": table.column("wx").to_numpy().astype(np.float64)[fix],
+        "wy": table.column("wy").to_numpy().astype(np.float64)[fix],
+        "fid": table.column("fid").to_numpy()[fix],
+        "saccades": int(sac.sum()),
+    }
+    return header, samples, events
 
-        wx = rec.get("wx", 0)
-        wy = rec.get("wy", 0)
 
-        col = int(wx) // tile_size
-        row = int(wy) // tile_size
+def compute_dense_dwell(samples, tile_size, slide_width, slide_height):
+    # type: (dict, int, int, int) -> tuple
+    """
+    Bin fixation samples into a dense tile grid.
 
-        if col < 0 or col >= max_col or row < 0 or row >= max_row:
-            skipped_oob += 1
-            continue
+    Returns (counts_2d, fix_keys): counts_2d is a (rows, cols) array of
+    sample counts; fix_keys holds the distinct (tile, fixation ID) pairs,
+    packed as flat_tile << 32 | fid. Keeping the pairs (rather than
+    per-tile fixation counts) lets aggregate() re-derive exact fixation
+    counts at coarser tile sizes.
+    """
+    wx = samples["wx"]
+    wy = samples["wy"]
+    fid = samples["fid"].astype(np.int64)
+    n = len(wx)
 
-        key = (col, row)
-        tile_dwell[key] += 1  # each sample = 1 count (convert to ms later)
-        tile_sample_count[key] += 1
+    max_col = (slide_width + tile_size - 1) // tile_size
+    max_row = (slide_height + tile_size - 1) // tile_size
+    n_tiles = max_col * max_row
 
-        fid = rec.get("fid", -1)
-        if fid >= 0:
-            tile_fixations[key].add(fid)
+    # int() truncates toward zero; match it before flooring to tile index.
+    # Bounds are the slide itself (not the padded last tile), so binning at
+    # any tile size sees the same samples and aggregate() stays exact.
+    x = np.trunc(wx).astype(np.int64)
+    y = np.trunc(wy).astype(np.int64)
+    valid = (x >= 0) & (x < slide_width) & (y >= 0) & (y < slide_height)
+    flat = (y // tile_size) * max_col + x // tile_size
 
-        counted += 1
+    skipped_saccade = samples.get("saccades", 0)
+    counted = int(valid.sum())
+    skipped_oob = n - counted
 
     print("[analyze] Counted: {}  Saccades skipped: {}  Out-of-bounds: {}".format(
         counted, skipped_saccade, skipped_oob
     ))
 
-    # Build DataFrame
-    rows = []
-    for (col, row), count in tile_dwell.items():
-        rows.append({
-            "tile_col": col,
-            "tile_row": row,
-            "wsi_x_min": col * tile_size,
-            "wsi_y_min": row * tile_size,
-            "wsi_x_max": min((col + 1) * tile_size, slide_width),
-            "wsi_y_max": min((row + 1) * tile_size, slide_height),
-            "sample_count": int(count),
-            "fixation_count": len(tile_fixations.get((col, row), set())),
-        })
-
-    if not rows:
+    counts = np.bincount(flat[valid], minlength=n_tiles)
+
+    # Distinct fixation IDs per tile: pack (tile, fid) into one int64 so a
+    # flat np.unique replaces a row-wise unique over pairs
+    fix_mask = valid & (fid >= 0)
+    fix_keys = np.unique((flat[fix_mask] << 32) | fid[fix_mask])
+
+    return counts.reshape(max_row, max_col), fix_keys
+
+
+def aggregate(counts_2d, fix_keys, factor):
+    # type: (np.ndarray, np.ndarray, int) -> tuple
+    """
+    Merge factor x factor blocks of tiles into one coarser tile.
+
+    Sample counts are summed with a reshape; fixation keys are remapped to
+    the coarse grid and deduplicated, so a fixation spanning several fine
+    tiles inside one coarse tile is still counted once.
+    """
+    if factor == 1:
+        return counts_2d, fix_keys
+
+    max_row, max_col = counts_2d.shape
+    pad_r = -max_row % factor
+    pad_c = -max_col % factor
+    padded = np.pad(counts_2d, ((0, pad_r), (0, pad_c)))
+    coarse_row = padded.shape[0] // factor
+    coarse_col = padded.shape[1] // factor
+    coarse = padded.reshape(coarse_row, factor, coarse_col, factor).sum(axis=(1, 3))
+
+    row, col = np.divmod(fix_keys >> 32, max_col)
+    flat = (row // factor) * coarse_col + col // factor
+    coarse_keys = np.unique((flat << 32) | (fix_keys & 0xFFFFFFFF))
+    return coarse, coarse_keys
+
+
+def dwell_frame(counts_2d, fix_keys, tile_size, slide_width, slide_height):
+    # type: (np.ndarray, np.ndarray, int, int, int) -> pd.DataFrame
+    """Build the per-tile dwell DataFrame from a dense grid."""
+    max_col = counts_2d.shape[1]
+    counts = counts_2d.ravel()
+    fix_counts = np.bincount((fix_keys >> 32).astype(np.intp), minlength=counts.size)
+
+    nz = np.nonzero(counts)[0]
+    if nz.size == 0:
         print("[analyze] WARNING: No gaze data mapped to tiles!")
         return pd.DataFrame()
 
-    df = pd.DataFrame(rows)
+    row_idx, col_idx = np.divmod(nz, max_col)
+    df = pd.DataFrame({
+        "tile_col": col_idx,
+        "tile_row": row_idx,
+        "wsi_x_min": col_idx * tile_size,
+        "wsi_y_min": row_idx * tile_size,
+        "wsi_x_max": np.minimum((col_idx + 1) * tile_size, slide_width),
+        "wsi_y_max": np.minimum((row_idx + 1) * tile_size, slide_height),
+        "sample_count": counts[nz],
+        "fixation_count": fix_counts[nz],
+    })
     df = df.sort_values(["sample_count"], ascending=False).reset_index(drop=True)
     return df
 
 
-def generate_heatmap(df, slide_path, tile_size, thumb_max, output_path):
-    # type: (pd.DataFrame, str, int, int, str) -> None
-    """Generate heatmap overlay on slide thumbnail."""
+def compute_dwell_map(samples, tile_size, slide_width, slide_height):
+    # type: (dict, int, int, int) -> pd.DataFrame
+    """
+    Compute per-tile dwell time and fixation count.
+
+    Each gaze sample contributes (1/sampling_rate) seconds of dwell time
+    to the tile it falls in. Saccade samples are excluded.
+
+    samples is the column dict returned by load_session. Samples are
+    binned with NumPy (bincount over flattened tile indices) rather than
+    a per-sample Python loop.
+    """
+    counts_2d, fix_keys = compute_dense_dwell(samples, tile_size,
+                                              slide_width, slide_height)
+    return dwell_frame(counts_2d, fix_keys, tile_size, slide_width, slide_height)
+
+
+def dwell_cache_path(cache_dir, session_path, base_tile_size, slide_dims):
+    # type: (str, str, int, tuple) -> str
+    """
+    Cache file for a session's dense dwell grid. The key covers the
+    session file's identity (path, size, mtime), the base tile size and
+    the slide dimensions.
+    """
+    st = os.stat(session_path)
+    key = "{}|{}|{}|{}|{}x{}".format(
+        os.path.abspath(session_path), st.st_size, st.st_mtime_ns,
+        base_tile_size, slide_dims[0], slide_dims[1],
+    )
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, "dwell_{}_{}.npz".format(digest, base_tile_size))
+
+
+def save_dwell_cache(path, counts_2d, fix_keys, header, events):
+    # type: (str, np.ndarray, np.ndarray, dict, list) -> None
+    meta = orjson.dumps({"header": header, "events": events}).decode("utf-8")
+    with open(path, "wb") as f:
+        np.savez(f, counts=counts_2d, fix_keys=fix_keys, meta=np.array(meta))
+    print("[analyze] Dwell cache saved: {}".format(path))
+
+
+def load_dwell_cache(path):
+    # type: (str) -> tuple
+    """Returns (counts_2d, fix_keys, header, events) from save_dwell_cache."""
+    with np.load(path) as data:
+        meta = orjson.loads(str(data["meta"]))
+        counts_2d = data["counts"]
+        fix_keys = data["fix_keys"]
+    print("[analyze] Loaded dwell cache: {}".format(path))
+    return counts_2d, fix_keys, meta["header"], meta["events"]
+
+
+def generate_heatmap(df, slide, tile_size, thumb_max, output_path):
+    # type: (pd.DataFrame, OpenSlide, int, int, str) -> None
+    """Generate heatmap overlay on slide thumbnail (slide stays open)."""
     if df.empty:
         print("[analyze] No data for heatmap.")
         return
 
-    slide = OpenSlide(slide_path)
     dims = slide.dimensions  # (width, height)
 
     # Compute thumbnail size preserving aspect ratio
@@ -169,7 +338,6 @@ def generate_heatmap(df, slide_path, tile_size, thumb_max, output_path):
     thumb_h = int(dims[1] * ratio)
     thumbnail = slide.get_thumbnail((thumb_w, thumb_h))
     thumbnail = thumbnail.convert("RGB")
-    slide.close()
 
     # Scale factor: WSI pixels → thumbnail pixels
     scale_x = thumb_w / float(dims[0])
@@ -179,6 +347,12 @@ def generate_heatmap(df, slide_path, tile_size, thumb_max, output_path):
     fig, ax = plt.subplots(1, 1, figsize=(14, 14 * thumb_h / thumb_w))
     ax.imshow(thumbnail)
 
+    # Dense (row, col) grid of sample counts, one cell per tile
+    max_col = (dims[0] + tile_size - 1) // tile_size
+    max_row = (dims[1] + tile_size - 1) // tile_size
+    heat = np.zeros((max_row, max_col), dtype=np.float32)
+    heat[df["tile_row"].to_numpy(), df["tile_col"].to_numpy()] = df["sample_count"].to_numpy()
+
     # Normalize sample counts for color mapping
     max_count = df["sample_count"].max()
     if max_count == 0:
@@ -186,22 +360,15 @@ def generate_heatmap(df, slide_path, tile_size, thumb_max, output_path):
     norm = Normalize(vmin=0, vmax=max_count)
     cmap = plt.cm.hot
 
-    for _, row in df.iterrows():
-        x = row["wsi_x_min"] * scale_x
-        y = row["wsi_y_min"] * scale_y
-        w = (row["wsi_x_max"] - row["wsi_x_min"]) * scale_x
-        h = (row["wsi_y_max"] - row["wsi_y_min"]) * scale_y
-
-        color = cmap(norm(row["sample_count"]))
-        alpha = min(0.8, 0.2 + 0.6 * norm(row["sample_count"]))
-
-        rect = mpatches.Rectangle(
-            (x, y), w, h,
-            linewidth=0,
-            facecolor=color,
-            alpha=alpha,
-        )
-        ax.add_patch(rect)
+    # Single RGBA overlay instead of one patch per tile; empty tiles stay clear
+    level = np.asarray(norm(heat), dtype=np.float32)
+    rgba = cmap(level)
+    rgba[..., 3] = np.where(heat > 0, np.minimum(0.8, 0.2 + 0.6 * level), 0.0)
+    ax.imshow(rgba, interpolation="nearest",
+              extent=(0, max_col * tile_size * scale_x,
+                      max_row * tile_size * scale_y, 0))
+    ax.set_xlim(-0.5, thumb_w - 0.5)
+    ax.set_ylim(thumb_h - 0.5, -0.5)
 
     ax.set_title("Gaze Dwell-Time Heatmap\n(tile size: {} WSI px)".format(tile_size),
                   fontsize=12, color="white")
@@ -268,12 +435,12 @@ def write_summary(header, df, events, output_path):
         lines.append("  {:>6s}  {:>6s}  {:>8s}  {:>5s}".format(
             "col", "row", "samples", "fixns"
         ))
-        for _, row in df.head(10).iterrows():
+        for row in df.nlargest(10, "sample_count").itertuples(index=False):
             lines.append("  {:6d}  {:6d}  {:8d}  {:5d}".format(
-                int(row["tile_col"]),
-                int(row["tile_row"]),
-                int(row["sample_count"]),
-                int(row["fixation_count"]),
+                int(row.tile_col),
+                int(row.tile_row),
+                int(row.sample_count),
+                int(row.fixation_count),
             ))
     else:
         lines.append("No gaze data mapped to tiles.")
@@ -302,29 +469,47 @@ def main():
 
     os.makedirs(args.output_dir, exist_ok=True)
 
-    # Load session
-    header, gaze_records, events = load_session(args.session)
-
-    # Get slide dimensions
-    slide = OpenSlide(args.slide)
-    slide_w, slide_h = slide.dimensions
-    slide.close()
-    print("[analyze] Slide: {} x {}".format(slide_w, slide_h))
-
-    # Compute dwell map
-    print("[analyze] Computing dwell map (tile_size={})...".format(args.tile_size))
-    df = compute_dwell_map(gaze_records, args.tile_size, slide_w, slide_h)
-
-    # Save CSV
-    csv_path = os.path.join(args.output_dir, "dwell_map.csv")
-    if not df.empty:
-        df.to_csv(csv_path, index=False)
-        print("[analyze] CSV saved: {}".format(csv_path))
+    base_tile_size = args.base_tile_size or args.tile_size
+    if args.tile_size % base_tile_size != 0:
+        print("ERROR: --tile-size must be a multiple of --base-tile-size")
+        sys.exit(1)
 
-    # Generate heatmap
-    heatmap_path = os.path.join(args.output_dir, "heatmap.png")
-    generate_heatmap(df, args.slide, args.tile_size,
-                     args.thumbnail_size, heatmap_path)
+    # One slide handle for dimensions and thumbnail
+    with OpenSlide(args.slide) as slide:
+        slide_w, slide_h = slide.dimensions
+        print("[analyze] Slide: {} x {}".format(slide_w, slide_h))
+
+        cache_path = None
+        if args.cache_dir:
+            os.makedirs(args.cache_dir, exist_ok=True)
+            cache_path = dwell_cache_path(args.cache_dir, args.session,
+                                          base_tile_size, (slide_w, slide_h))
+
+        # Compute dwell map
+        print("[analyze] Computing dwell map (tile_size={})...".format(args.tile_size))
+        if cache_path and os.path.isfile(cache_path):
+            counts_2d, fix_keys, header, events = load_dwell_cache(cache_path)
+        else:
+            header, samples, events = load_session(args.session)
+            counts_2d, fix_keys = compute_dense_dwell(samples, base_tile_size,
+                                                      slide_w, slide_h)
+            if cache_path:
+                save_dwell_cache(cache_path, counts_2d, fix_keys, header, events)
+
+        counts_2d, fix_keys = aggregate(counts_2d, fix_keys,
+                                        args.tile_size // base_tile_size)
+        df = dwell_frame(counts_2d, fix_keys, args.tile_size, slide_w, slide_h)
+
+        # Save CSV
+        csv_path = os.path.join(args.output_dir, "dwell_map.csv")
+        if not df.empty:
+            df.to_csv(csv_path, index=False)
+            print("[analyze] CSV saved: {}".format(csv_path))
+
+        # Generate heatmap
+        heatmap_path = os.path.join(args.output_dir, "heatmap.png")
+        generate_heatmap(df, slide, args.tile_size,
+                         args.thumbnail_size, heatmap_path)
 
     # Write summary
     summary_path = os.path.join(args.output_dir, "session_summary.txt")
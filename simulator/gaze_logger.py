@@ -1,21 +1,108 @@
 """
 gaze_logger.py
-Logs gaze data to JSONL files.
+Logs gaze data to JSONL files, or to Arrow IPC with a JSONL sidecar.
 """
 
 import os
-import json
 import time
+import queue
+import threading
+from array import array
 from datetime import datetime
+from typing import Optional
+
+import orjson
 
 from gaze_source import GazePoint
 
 
+class ArrowGazeWriter:
+    """
+    Buffers gaze samples into typed columns and writes them as Arrow IPC
+    stream record batches. The analyzer reads the columns back as arrays
+    with no text parsing.
+
+    Needs pyarrow, imported here so the default JSONL log doesn't.
+    """
+
+    def __init__(self, path, compress=False, batch_size=4096, max_age=5.0):
+        # type: (str, bool, int, float) -> None
+        import pyarrow as pa
+        self._pa = pa
+        self._schema = pa.schema([
+            ("t", pa.float64()),
+            ("wx", pa.float32()),
+            ("wy", pa.float32()),
+            ("sac", pa.bool_()),
+            ("fid", pa.int32()),
+        ])
+        options = pa.ipc.IpcWriteOptions(compression="zstd" if compress else None)
+        self._sink = pa.OSFile(path, "wb")
+        self._writer = pa.ipc.new_stream(self._sink, self._schema, options=options)
+        self._batch_size = batch_size
+        self._max_age = max_age
+        self._last_write = time.monotonic()
+        self._reset()
+
+    def _reset(self):
+        # type: () -> None
+        self._t = array("d")
+        self._wx = array("f")
+        self._wy = array("f")
+        self._sac = []
+        self._fid = array("i")
+
+    def append(self, point):
+        # type: (GazePoint) -> bool
+        """Buffer a sample; returns True if this wrote a batch."""
+        self._t.append(point.timestamp_ms)
+        self._wx.append(point.wsi_x)
+        self._wy.append(point.wsi_y)
+        self._sac.append(point.is_saccade)
+        self._fid.append(point.fixation_id)
+
+        # Write a batch when full, or every few seconds to bound data loss
+        if (len(self._t) >= self._batch_size
+                or time.monotonic() - self._last_write > self._max_age):
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        # type: () -> None
+        self._last_write = time.monotonic()
+        if not self._t:
+            return
+        pa = self._pa
+        batch = pa.record_batch([
+            pa.array(self._t, type=pa.float64()),
+            pa.array(self._wx, type=pa.float32()),
+            pa.array(self._wy, type=pa.float32()),
+            pa.array(self._sac, type=pa.bool_()),
+            pa.array(self._fid, type=pa.int32()),
+        ], schema=self._schema)
+        self._writer.write_batch(batch)
+        self._reset()
+
+    def close(self):
+        # type: () -> None
+        self.flush()
+        self._writer.close()
+        self._sink.close()
+
+
 class GazeLogger:
-    """Appends gaze points to a JSONL file, one JSON object per line."""
+    """
+    Appends gaze points to a JSONL file, one JSON object per line.
+
+    With log_format="arrow", gaze samples go to an Arrow IPC stream
+    (.arrow) and the header and events go to a JSONL sidecar with the
+    same name (.jsonl).
+    """
 
-    def __init__(self, output_dir, slide_info, simulator_config):
-        # type: (str, dict, dict) -> None
+    def __init__(self, output_dir, slide_info, simulator_config, compress=False,
+                 log_format="jsonl"):
+        # type: (str, dict, dict, bool, str) -> None
         """
         Create a new session log file.
 
@@ -23,17 +110,37 @@ class GazeLogger:
             output_dir: directory to write log files
             slide_info: dict from /slide/info
             simulator_config: dict of simulator parameters
+            compress: zstd-compress the log (.jsonl.zst, or compressed
+                      Arrow buffers for the arrow format)
+            log_format: "jsonl" or "arrow"
         """
         os.makedirs(output_dir, exist_ok=True)
 
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         slide_name = slide_info.get("filename", "unknown")
         safe_name = slide_name.replace(".", "_")
-        filename = "session_{}_{}.jsonl".format(safe_name, timestamp)
-        self.filepath = os.path.join(output_dir, filename)
+        basename = "session_{}_{}".format(safe_name, timestamp)
 
-        self._file = open(self.filepath, "w", encoding="utf-8")
+        self._gaze_writer = None   # type: Optional[ArrowGazeWriter]
+        if log_format == "arrow":
+            self.filepath = os.path.join(output_dir, basename + ".arrow")
+            self._gaze_writer = ArrowGazeWriter(self.filepath, compress=compress)
+            events_path = os.path.join(output_dir, basename + ".jsonl")
+            self._file = open(events_path, "wb", buffering=64 * 1024)
+        else:
+            filename = basename + ".jsonl"
+            if compress:
+                filename += ".zst"
+            self.filepath = os.path.join(output_dir, filename)
+
+            self._file = open(self.filepath, "wb", buffering=64 * 1024)
+            if compress:
+                import zstandard   # optional; only needed for --compress
+                # Level 3 compresses the repetitive JSONL ~10x at negligible CPU
+                self._file = zstandard.ZstdCompressor(level=3).stream_writer(self._file)
         self._count = 0
+        self._start_monotonic = time.monotonic()
+        self._last_flush = self._start_monotonic
 
         # Write header as first line
         header = {
@@ -52,34 +159,66 @@ class GazeLogger:
     def log(self, point):
         # type: (GazePoint) -> None
         """Log a single gaze point."""
+        if self._gaze_writer is not None:
+            self._count += 1
+            # Flush the events sidecar along with each gaze batch, so
+            # events aren't held back until close
+            if self._gaze_writer.append(point):
+                self._flush()
+            return
+
         record = point.to_dict()
         record["type"] = "gaze"
         self._write_line(record)
         self._count += 1
 
-        # Flush every 100 samples to avoid data loss
-        if self._count % 100 == 0:
-            self._file.flush()
+        # Flush every 1000 samples or once a second to bound data loss
+        if self._count % 1000 == 0:
+            self._flush()
+        else:
+            now = time.monotonic()
+            if now - self._last_flush > 1.0:
+                self._flush(now)
 
-    def log_event(self, event_type, data=None):
-        # type: (str, dict) -> None
-        """Log a non-gaze event (click, viewport change, etc.)."""
+    def log_event(self, event_type, data=None, timestamp_ms=None):
+        # type: (str, dict, float) -> None
+        """
+        Log a non-gaze event (click, viewport change, etc.).
+
+        Pass timestamp_ms from the gaze source's session_ms() so events
+        share the gaze samples' timeline; it defaults to milliseconds since
+        the log was opened, which starts earlier (before the connect).
+        """
+        if timestamp_ms is None:
+            timestamp_ms = self.elapsed_ms()
         record = {
             "type": event_type,
-            "t": round(time.time() * 1000, 1),
+            "t": round(timestamp_ms, 1),
         }
         if data:
             record.update(data)
         self._write_line(record)
 
+    def elapsed_ms(self):
+        # type: () -> float
+        """Milliseconds since the log was opened (monotonic clock)."""
+        return (time.monotonic() - self._start_monotonic) * 1000.0
+
     def _write_line(self, obj):
         # type: (dict) -> None
-        self._file.write(json.dumps(obj, separators=(",", ":")) + "\n")
+        self._file.write(orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE))
+
+    def _flush(self, now=None):
+        # type: (float) -> None
+        self._file.flush()
+        self._last_flush = time.monotonic() if now is None else now
 
     def close(self):
         # type: () -> None
         """Flush and close the log file."""
         if self._file and not self._file.closed:
+            if self._gaze_writer is not None:
+                self._gaze_writer.close()
             self._file.flush()
             self._file.close()
             print("[logger] Closed. {} gaze samples written to {}".format(
@@ -89,4 +228,107 @@ class GazeLogger:
     @property
     def sample_count(self):
         # type: () -> int
-        return self._count
\ No newline at end of file
+        return self._count
+
+
+class BackgroundGazeLogger:
+    """
+    Runs a GazeLogger on its own writer thread so disk I/O never stalls
+    the gaze send loop.
+
+    Points go through a bounded queue and are dropped (and counted) if the
+    writer falls that far behind. Events wait for room instead, and are
+    only dropped if the writer thread has died. Event timestamps are taken
+    when log_event is called, not when written.
+    """
+
+    _STOP = object()
+
+    def __init__(self, logger, max_queue=4096, drain_max=128):
+        # type: (GazeLogger, int, int) -> None
+        self._logger = logger
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._drain_max = drain_max
+        self._dropped = 0
+        self._dropped_events = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def filepath(self):
+        # type: () -> str
+        return self._logger.filepath
+
+    @property
+    def sample_count(self):
+        # type: () -> int
+        return self._logger.sample_count
+
+    def log(self, point):
+        # type: (GazePoint) -> None
+        """Queue a gaze point; drops it if the queue is full."""
+        try:
+            self._queue.put_nowait(point)
+        except queue.Full:
+            self._dropped += 1
+
+    def log_event(self, event_type, data=None, timestamp_ms=None):
+        # type: (str, dict, float) -> None
+        """Queue a non-gaze event, stamped now if no timestamp is given."""
+        if timestamp_ms is None:
+            timestamp_ms = self._logger.elapsed_ms()
+        item = (event_type, data, timestamp_ms)
+        # Wait in short slices so a dead writer can't hang the caller on a
+        # queue nothing drains any more
+        while self._thread.is_alive():
+            try:
+                self._queue.put(item, timeout=0.25)
+                return
+            except queue.Full:
+                pass
+        if not self._dropped_events:
+            print("[logger] Writer stopped; dropping events")
+        self._dropped_events += 1
+
+    def _run(self):
+        # type: () -> None
+        q = self._queue
+        log = self._logger.log
+        log_event = self._logger.log_event
+        stop = self._STOP
+        try:
+            while True:
+                items = [q.get()]
+                # Take whatever else is already queued so bursts are
+                # written in one pass
+                try:
+                    while len(items) < self._drain_max:
+                        items.append(q.get_nowait())
+                except queue.Empty:
+                    pass
+
+                for item in items:
+                    if item is stop:
+                        return
+                    if type(item) is tuple:
+                        log_event(*item)
+                    else:
+                        log(item)
+        except Exception as e:
+            print("[logger] Writer error: {}".format(e))
+
+    def close(self):
+        # type: () -> None
+        """Write everything still queued, then close the log file."""
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+        if self._dropped:
+            print("[logger] Dropped {} gaze samples (writer fell behind)".format(
+                self._dropped
+            ))
+        if self._dropped_events:
+            print("[logger] Dropped {} events (writer stopped)".format(
+                self._dropped_events
+            ))
+        self._logger.close()
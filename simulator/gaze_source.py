@@ -10,11 +10,16 @@ import math
 import random
 import threading
 from abc import ABC, abstractmethod
+from collections import deque
 from dataclasses import dataclass
-from typing import Optional, List, Tuple, Iterator
+from functools import lru_cache
+from typing import Optional, Deque, List, Tuple, Iterator
 
+import msgspec
+import numpy as np
 
-@dataclass
+
+@dataclass(slots=True)
 class GazePoint:
     """Single gaze sample."""
     timestamp_ms: float
@@ -43,6 +48,43 @@ class GazePoint:
             "fixation_id": self.fixation_id,
         }
 
+    def to_msg(self):
+        # type: () -> GazeMsg
+        """Typed equivalent of to_ws_message() for the msgspec encoder."""
+        return GazeMsg(
+            round(self.wsi_x, 1),
+            round(self.wsi_y, 1),
+            self.is_saccade,
+            self.fixation_id,
+        )
+
+
+class GazeMsg(msgspec.Struct, tag="gaze_point", tag_field="type"):
+    """Wire form of a gaze point; encodes like GazePoint.to_ws_message()."""
+    wsi_x: float
+    wsi_y: float
+    is_saccade: bool
+    fixation_id: int
+
+
+class GazeBatchMsg(msgspec.Struct, tag="gaze_batch", tag_field="type"):
+    """Several gaze points sent as one WebSocket message."""
+    points: List[GazeMsg]
+
+
+# Longest idle wait between checks for Ctrl+C (seconds)
+IDLE_WAIT_S = 0.5
+
+
+@lru_cache(maxsize=64)
+def _smoothstep(n_samples):
+    # type: (int) -> np.ndarray
+    """Ease-in-out profile t^2 * (3 - 2t) over n_samples, cached per length."""
+    t = np.linspace(0.0, 1.0, n_samples)
+    ts = t * t * (3.0 - 2.0 * t)
+    ts.flags.writeable = False
+    return ts
+
 
 class GazeSource(ABC):
 
@@ -68,7 +110,11 @@ class GazeSource(ABC):
 
     @abstractmethod
     def get_stream(self):
-        # type: () -> Iterator[GazePoint]
+        # type: () -> Iterator[Optional[GazePoint]]
+        """
+        Yield gaze samples while running. Yields None when the source goes
+        idle so consumers can flush anything they are buffering.
+        """
         pass
 
 
@@ -104,18 +150,23 @@ class SimulatedGazeSource(GazeSource):
         self.auto_interval = auto_interval
 
         self._running = False
-        self._targets = []             # type: List[Tuple[float, float]]
-        self._target_lock = threading.Lock()
-        self._viewport = None          # type: Optional[dict]
+        # append/popleft on a deque are atomic, so the listener thread can
+        # queue targets while the stream consumes them without a lock
+        self._targets = deque()        # type: Deque[Tuple[float, float]]
+        self._wakeup = threading.Event()  # set on new target/viewport/stop
+        # (x_min, x_max, y_min, y_max) as floats, swapped as one tuple
+        self._vp_bounds = None         # type: Optional[Tuple[float, float, float, float]]
         self._container_width = 1920   # default until viewer reports
         self._effective_sigma = sigma_screen_pixels  # WSI pixels (updated on viewport change)
         self._fixation_id = 0
         self._start_time = 0.0
+        self._next_sample = 0.0
+        self._rng = np.random.default_rng()
 
     def start(self):
         # type: () -> None
         self._running = True
-        self._start_time = time.time()
+        self._start_time = time.perf_counter()
         self._fixation_id = 0
         print("[gaze] Started (mode={}, sigma_screen={}, rate={} Hz)".format(
             self.mode, self.sigma_screen, self.sampling_rate
@@ -124,12 +175,13 @@ class SimulatedGazeSource(GazeSource):
     def stop(self):
         # type: () -> None
         self._running = False
+        self._wakeup.set()
         print("[gaze] Stopped")
 
     def add_fixation_target(self, wsi_x, wsi_y):
         # type: (float, float) -> None
-        with self._target_lock:
-            self._targets.append((wsi_x, wsi_y))
+        self._targets.append((wsi_x, wsi_y))
+        self._wakeup.set()
         print("[gaze] Target: ({:.0f}, {:.0f})  sigma_wsi={:.1f}  queue={}".format(
             wsi_x, wsi_y, self._effective_sigma, len(self._targets)
         ))
@@ -143,46 +195,87 @@ class SimulatedGazeSource(GazeSource):
 
         This makes the visual scatter constant on screen regardless of zoom.
         """
-        self._viewport = bounds
+        x_min = float(bounds["x_min"])
+        x_max = float(bounds["x_max"])
+        y_min = float(bounds["y_min"])
+        y_max = float(bounds["y_max"])
         self._container_width = max(container_width, 1)
 
-        viewport_wsi_width = float(bounds["x_max"] - bounds["x_min"])
-        wsi_per_screen = viewport_wsi_width / self._container_width
+        wsi_per_screen = (x_max - x_min) / self._container_width
         self._effective_sigma = self.sigma_screen * wsi_per_screen
+        self._vp_bounds = (x_min, x_max, y_min, y_max)
+        self._wakeup.set()
 
     def _get_next_target(self):
         # type: () -> Optional[Tuple[float, float]]
         if self.mode == "manual":
-            with self._target_lock:
-                if self._targets:
-                    return self._targets.pop(0)
-            return None
+            try:
+                return self._targets.popleft()
+            except IndexError:
+                return None
 
         elif self.mode == "auto":
-            vp = self._viewport
+            vp = self._vp_bounds
             if vp is None:
                 return None
-            x = random.uniform(vp["x_min"], vp["x_max"])
-            y = random.uniform(vp["y_min"], vp["y_max"])
-            return (x, y)
+            x_min, x_max, y_min, y_max = vp
+            return (random.uniform(x_min, x_max), random.uniform(y_min, y_max))
 
         return None
 
+    def session_ms(self):
+        # type: () -> float
+        """
+        Milliseconds since start(), read now from the same perf_counter
+        clock as the sample timestamps, for stamping events that aren't
+        samples (clicks, viewport changes) on the gaze timeline.
+        """
+        return (time.perf_counter() - self._start_time) * 1000.0
+
     def _elapsed_ms(self):
         # type: () -> float
-        return (time.time() - self._start_time) * 1000.0
+        """
+        Timestamp of the current sample, taken from its pacing deadline
+        rather than a fresh clock read. Monotonic, and evenly spaced even
+        when a sample is yielded late.
+        """
+        return (self._next_sample - self._start_time) * 1000.0
+
+    def _wait_next_sample(self):
+        # type: () -> None
+        """
+        Sleep until the next sample deadline. Pacing against a running
+        deadline keeps the rate steady instead of drifting by the time
+        spent generating and sending each sample.
+        """
+        self._next_sample += self.sample_interval
+        delay = self._next_sample - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            # Fell behind (e.g. slow send) — resync rather than burst
+            self._next_sample = time.perf_counter()
 
     def get_stream(self):
-        # type: () -> Iterator[GazePoint]
+        # type: () -> Iterator[Optional[GazePoint]]
         prev_target = None  # type: Optional[Tuple[float, float]]
 
         while self._running:
+            # Clear before checking so a target queued in between still
+            # wakes the wait below
+            self._wakeup.clear()
             target = self._get_next_target()
 
             if target is None:
-                time.sleep(0.05)
+                yield None
+                # Block until a target/viewport arrives instead of polling.
+                # The timeout only keeps Ctrl+C responsive on Windows, where
+                # an untimed lock wait cannot be interrupted.
+                self._wakeup.wait(IDLE_WAIT_S)
                 continue
 
+            self._next_sample = time.perf_counter()
+
             # Saccade to new target
             if prev_target is not None:
                 for pt in self._generate_saccade(prev_target, target):
@@ -200,6 +293,7 @@ class SimulatedGazeSource(GazeSource):
 
             if self.mode == "auto":
                 pause = self.auto_interval * random.uniform(0.5, 1.5)
+                yield None
                 time.sleep(pause)
 
     def _generate_fixation(self, target):
@@ -215,22 +309,29 @@ class SimulatedGazeSource(GazeSource):
 
         sigma = self._effective_sigma
 
-        for i in range(n_samples):
+        # Draw all noise for this fixation in one call
+        noise = self._rng.normal(0.0, sigma, (n_samples, 2))
+        xs = (tx + noise[:, 0]).tolist()
+        ys = (ty + noise[:, 1]).tolist()
+
+        # Bind per-sample lookups to locals for the hot loop
+        point = GazePoint
+        elapsed_ms = self._elapsed_ms
+        wait_next_sample = self._wait_next_sample
+
+        for x, y in zip(xs, ys):
             if not self._running:
                 return
 
-            noise_x = random.gauss(0, sigma)
-            noise_y = random.gauss(0, sigma)
-
-            yield GazePoint(
-                timestamp_ms=self._elapsed_ms(),
-                wsi_x=tx + noise_x,
-                wsi_y=ty + noise_y,
+            yield point(
+                timestamp_ms=elapsed_ms(),
+                wsi_x=x,
+                wsi_y=y,
                 is_saccade=False,
                 fixation_id=fid,
                 source="simulator",
             )
-            time.sleep(self.sample_interval)
+            wait_next_sample()
 
     def _generate_saccade(self, start, end):
         # type: (Tuple[float, float], Tuple[float, float]) -> Iterator[GazePoint]
@@ -242,22 +343,25 @@ class SimulatedGazeSource(GazeSource):
         sx, sy = start
         ex, ey = end
 
-        for i in range(n_samples):
-            if not self._running:
-                return
+        t_smooth = _smoothstep(n_samples)
+        xs = (sx + (ex - sx) * t_smooth).tolist()
+        ys = (sy + (ey - sy) * t_smooth).tolist()
 
-            t = i / float(n_samples - 1)
-            t_smooth = t * t * (3.0 - 2.0 * t)
+        # Bind per-sample lookups to locals for the hot loop
+        point = GazePoint
+        elapsed_ms = self._elapsed_ms
+        wait_next_sample = self._wait_next_sample
 
-            x = sx + (ex - sx) * t_smooth
-            y = sy + (ey - sy) * t_smooth
+        for x, y in zip(xs, ys):
+            if not self._running:
+                return
 
-            yield GazePoint(
-                timestamp_ms=self._elapsed_ms(),
+            yield point(
+                timestamp_ms=elapsed_ms(),
                 wsi_x=x,
                 wsi_y=y,
                 is_saccade=True,
                 fixation_id=-1,
                 source="simulator",
             )
-            time.sleep(self.sample_interval)
\ No newline at end of file
+            wait_next_sample()
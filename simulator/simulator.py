@@ -11,17 +11,46 @@ Examples:
 """
 
 import sys
-import json
 import time
 import signal
+import socket
 import argparse
 import threading
+from collections import deque
+from typing import Dict, Optional, Union
 
+import msgspec
 import requests
 import websockets.sync.client
+from websockets.exceptions import ConnectionClosed
 
-from gaze_source import SimulatedGazeSource
-from gaze_logger import GazeLogger
+from gaze_source import SimulatedGazeSource, GazeBatchMsg
+from gaze_logger import GazeLogger, BackgroundGazeLogger
+
+
+# Gaze points per WebSocket message, and the longest a point may wait
+WS_BATCH_SIZE = 8
+WS_BATCH_MAX_AGE = 0.016  # seconds (one 60 Hz display frame)
+
+# Typed JSON encoder for outgoing gaze messages, reused for every send
+_ENCODER = msgspec.json.Encoder()
+
+
+class ClickMsg(msgspec.Struct, tag="click", tag_field="type"):
+    """Ctrl+Click in the viewer: place a fixation target."""
+    wsi_x: float = 0.0
+    wsi_y: float = 0.0
+
+
+class ViewportMsg(msgspec.Struct, tag="viewport_update", tag_field="type"):
+    """Viewer pan/zoom: visible WSI bounds and canvas width."""
+    bounds_wsi: Optional[Dict[str, float]] = None
+    container_width: int = 1920
+
+
+# Decodes and validates viewer messages straight into the structs above;
+# fields the simulator does not use are skipped
+_DECODER = msgspec.json.Decoder(Union[ClickMsg, ViewportMsg])
 
 
 def parse_args():
@@ -42,6 +71,11 @@ def parse_args():
                     help="Seconds between auto fixations")
     p.add_argument("--log-dir", default="./logs",
                     help="Directory for JSONL logs")
+    p.add_argument("--compress", action="store_true",
+                    help="Write zstd-compressed logs (.jsonl.zst)")
+    p.add_argument("--log-format", choices=["jsonl", "arrow"], default="jsonl",
+                    help="jsonl = one JSON line per sample, "
+                         "arrow = Arrow IPC gaze columns + JSONL sidecar")
     return p.parse_args()
 
 
@@ -84,19 +118,33 @@ def main():
         "sampling_rate": args.rate,
         "fixation_range": [args.fix_min, args.fix_max],
     }
-    logger = GazeLogger(args.log_dir, slide_info, config)
+    session_log = GazeLogger(args.log_dir, slide_info, config,
+                             compress=args.compress, log_format=args.log_format)
+    # File writes happen on the logger's own thread, off the send loop
+    logger = BackgroundGazeLogger(session_log)
 
     ws_url = args.viewer_url.replace("http://", "ws://").replace("https://", "wss://")
     ws_url = ws_url + "/ws"
     print("[sim] Connecting to {} ...".format(ws_url))
 
     try:
-        ws = websockets.sync.client.connect(ws_url)
+        # Gaze batches are a few hundred bytes; per-frame deflate costs more
+        # CPU than it saves on a local link
+        ws = websockets.sync.client.connect(ws_url, compression=None,
+                                            open_timeout=5)
     except Exception as e:
         print("[sim] ERROR: WebSocket failed — {}".format(e))
         logger.close()
         sys.exit(1)
 
+    # Small frames must go out immediately, not wait on Nagle coalescing.
+    # Recent websockets releases already do this; set it regardless of
+    # version.
+    try:
+        ws.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:
+        pass
+
     print("[sim] Connected!")
     print("")
 
@@ -127,94 +175,157 @@ def main():
 
     # Thread: listen for messages FROM viewer
     def listen_thread():
+        # Bind per-message lookups to locals for the receive loop
+        recv = ws.recv
+        decode = _DECODER.decode
+        stopping = shutdown_event.is_set
+        add_target = source.add_fixation_target
+        set_viewport = source.set_viewport
+        log_event = logger.log_event
+        session_ms = source.session_ms
+
+        def apply_viewport(msg):
+            if msg.bounds_wsi:
+                set_viewport(msg.bounds_wsi, container_width=msg.container_width)
+
         try:
-            while not shutdown_event.is_set():
+            while not stopping():
                 try:
-                    raw = ws.recv(timeout=0.5)
-                    msg = json.loads(raw)
-                except TimeoutError:
-                    continue
+                    # Blocks until a message arrives; closing the socket
+                    # during shutdown ends the wait
+                    frames = [recv()]
+                    # Take whatever else already arrived, so a burst of
+                    # viewport updates while panning is applied once
+                    while True:
+                        try:
+                            frames.append(recv(timeout=0))
+                        except TimeoutError:
+                            break
+                except ConnectionClosed:
+                    break
                 except Exception:
-                    if shutdown_event.is_set():
+                    if stopping():
                         break
                     continue
 
-                msg_type = msg.get("type", "")
-
-                if msg_type == "click":
-                    wsi_x = msg.get("wsi_x", 0)
-                    wsi_y = msg.get("wsi_y", 0)
-                    source.add_fixation_target(wsi_x, wsi_y)
-                    logger.log_event("click_target", {
-                        "wsi_x": round(wsi_x, 1),
-                        "wsi_y": round(wsi_y, 1),
-                    })
-
-                elif msg_type == "viewport_update":
-                    bounds = msg.get("bounds_wsi")
-                    cw = msg.get("container_width", 1920)
-                    if bounds:
-                        source.set_viewport(bounds, container_width=cw)
+                # Consecutive viewport updates supersede each other; only
+                # the newest of a run is applied, before any later click
+                viewport = None
+                for raw in frames:
+                    try:
+                        msg = decode(raw)
+                    except msgspec.DecodeError:
+                        # Malformed, or a message type the simulator ignores
+                        continue
+
+                    if isinstance(msg, ViewportMsg):
+                        viewport = msg
+
+                    elif isinstance(msg, ClickMsg):
+                        if viewport is not None:
+                            apply_viewport(viewport)
+                            viewport = None
+                        add_target(msg.wsi_x, msg.wsi_y)
+                        # Stamped on the gaze source's clock, so event and
+                        # gaze t share one session timeline
+                        log_event("click_target", {
+                            "wsi_x": round(msg.wsi_x, 1),
+                            "wsi_y": round(msg.wsi_y, 1),
+                        }, timestamp_ms=session_ms())
+
+                if viewport is not None:
+                    apply_viewport(viewport)
 
         except Exception as e:
             if not shutdown_event.is_set():
                 print("[sim] Listen error: {}".format(e))
 
+    # Start the source's clock before any click can be logged against it
+    source.start()
     listener = threading.Thread(target=listen_thread, daemon=True)
     listener.start()
 
-    # Thread: generate gaze and send
-    def gaze_thread():
-        sample_count = 0
-        last_status = time.time()
-
-        try:
-            source.start()
+    # Generate gaze and send on the main thread; SIGINT stops the source,
+    # which ends the stream
+    sample_count = 0
+    last_status = time.monotonic()
+
+    # Points are sent in small batches to amortize per-frame overhead
+    batch = deque()
+    batch_start = 0.0
+    sample_interval = source.sample_interval
+    send_buf = bytearray(1024)  # encode target, resized in place per send
+
+    def flush_buffer():
+        if not batch:
+            return
+        msg = GazeBatchMsg([p.to_msg() for p in batch])
+        batch.clear()
+        _ENCODER.encode_into(msg, send_buf)
+        # Sent as a text frame: the viewer relay and browser expect JSON text.
+        # send(..., text=True) needs websockets 14 or newer.
+        ws.send(send_buf, text=True)
 
-            for point in source.get_stream():
-                if shutdown_event.is_set():
-                    break
+    try:
+        for point in source.get_stream():
+            if shutdown_event.is_set():
+                break
+
+            if point is not None:
+                if not batch:
+                    batch_start = time.monotonic()
+                batch.append(point)
+                logger.log(point)
 
+            # Flush when full, when the oldest point would be too old by
+            # the time the next sample arrives, or when the source goes idle
+            if batch and (point is None
+                          or len(batch) >= WS_BATCH_SIZE
+                          or time.monotonic() + sample_interval - batch_start
+                          >= WS_BATCH_MAX_AGE):
+                # Counted and reported once per batch, not per sample
+                sample_count += len(batch)
+                last_fid = batch[-1].fixation_id
                 try:
-                    ws.send(json.dumps(point.to_ws_message()))
+                    flush_buffer()
                 except Exception:
                     if shutdown_event.is_set():
                         break
                     print("[sim] WS send failed")
                     break
 
-                logger.log(point)
-                sample_count += 1
-
-                now = time.time()
+                now = time.monotonic()
                 if now - last_status > 2.0:
                     print("[sim] Samples: {}  |  FID: {}  |  sigma_wsi: {:.1f}".format(
                         sample_count,
-                        point.fixation_id,
+                        last_fid,
                         source._effective_sigma,
                     ))
                     last_status = now
 
-        except Exception as e:
-            if not shutdown_event.is_set():
-                print("[sim] Gaze error: {}".format(e))
-
-    gaze = threading.Thread(target=gaze_thread, daemon=True)
-    gaze.start()
-
-    try:
-        while not shutdown_event.is_set():
-            shutdown_event.wait(timeout=1.0)
     except KeyboardInterrupt:
         handle_shutdown()
+    except Exception as e:
+        if not shutdown_event.is_set():
+            print("[sim] Gaze error: {}".format(e))
 
-    gaze.join(timeout=3)
-    listener.join(timeout=3)
+    # Drain points still buffered when the stream stopped
+    try:
+        flush_buffer()
+    except Exception:
+        pass
 
+    if not shutdown_event.is_set():
+        source.stop()
+        shutdown_event.set()
+
+    # Close after the drain so the last batch goes out; this also unblocks
+    # the listener's recv()
     try:
         ws.close()
     except Exception:
         pass
+    listener.join(timeout=3)
 
     logger.close()
     print("[sim] Done.")
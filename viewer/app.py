@@ -11,16 +11,21 @@ Example:
 
 import os
 import sys
+import time
 import atexit
+import asyncio
 import argparse
-from io import BytesIO
+import threading
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import Response, HTMLResponse, JSONResponse
+import orjson
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, HTMLResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
 
-from wsi_reader import WSIReader
+from wsi_reader import WSIReader, JPEG_ENCODER
 
 
 # ---------------------------------------------------------------------------
@@ -33,18 +38,35 @@ def parse_args():
     parser.add_argument("--port", type=int, default=8000)
     parser.add_argument("--host", type=str, default="127.0.0.1")
     parser.add_argument("--tile-size", type=int, default=256)
+    parser.add_argument("--tile-cache-mb", type=int, default=128,
+                        help="In-memory cache for encoded tiles (MB, 0 = off)")
+    parser.add_argument("--tile-cache-dir", type=str, default=None,
+                        help="Also keep encoded tiles on disk here, reused "
+                             "across restarts (default: off)")
     return parser.parse_args()
 
 
 args = parse_args()
 
+# Tile worker threads, and one OpenSlide handle per worker
+TILE_WORKERS = os.cpu_count() or 4
+PREFETCH_WORKERS = max(TILE_WORKERS // 2, 1)
+
+# uvloop and httptools come with uvicorn[standard] (uvloop is not built
+# for Windows); fall back to the stock asyncio loop and h11 parser
+UVICORN_LOOP = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+UVICORN_HTTP = "httptools" if importlib.util.find_spec("httptools") else "h11"
+
 # ---------------------------------------------------------------------------
 # Slide reader
 # ---------------------------------------------------------------------------
 
 print("[viewer] Loading slide: {}".format(args.slide))
 try:
-    reader = WSIReader(args.slide, tile_size=args.tile_size)
+    reader = WSIReader(args.slide, tile_size=args.tile_size,
+                       tile_cache_mb=args.tile_cache_mb,
+                       handles=TILE_WORKERS + PREFETCH_WORKERS,
+                       tile_cache_dir=args.tile_cache_dir)
 except Exception as e:
     print("[viewer] ERROR: Could not open slide — {}".format(e))
     sys.exit(1)
@@ -56,6 +78,30 @@ print("[viewer]   Dimensions : {}".format(info["slide_dimensions"]))
 print("[viewer]   Objective  : {}".format(info["objective_power"]))
 print("[viewer]   DZ levels  : {}".format(info["dz_level_count"]))
 print("[viewer]   Tile size  : {}".format(info["tile_size"]))
+print("[viewer]   Tile cache : {} MB".format(args.tile_cache_mb))
+if reader.disk_cache is not None:
+    print("[viewer]   Disk cache : {}".format(reader.disk_cache.directory))
+print("[viewer]   JPEG       : {}".format(JPEG_ENCODER))
+print("[viewer]   Server     : {} + {}".format(UVICORN_LOOP, UVICORN_HTTP))
+if reader.native_levels:
+    print("[viewer]   Passthrough: DZ levels {}".format(reader.native_levels))
+
+
+def pin_overview_tiles():
+    start = time.monotonic()
+    try:
+        count = reader.pin_overview_tiles()
+    except Exception as e:
+        print("[viewer] Pinning overview tiles failed: {}".format(e))
+        return
+    print("[viewer] Pinned {} overview tiles (DZ levels 0-{}, {} KB) in {:.1f}s".format(
+        count, reader.pinned_levels[-1], reader.tile_cache.pinned_bytes // 1024,
+        time.monotonic() - start))
+
+
+# Overview tiles are read in the background so startup isn't held up
+if args.tile_cache_mb > 0 and reader.pinned_levels:
+    threading.Thread(target=pin_overview_tiles, name="pin", daemon=True).start()
 
 # ---------------------------------------------------------------------------
 # FastAPI
@@ -64,35 +110,155 @@ print("[viewer]   Tile size  : {}".format(info["tile_size"]))
 app = FastAPI(title="WSI Viewer")
 STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
 
+# Slide reads and JPEG encodes block; they run here so the event loop keeps
+# serving other tiles and the WebSocket relay. OpenSlide releases the GIL
+# while reading, so the workers run in parallel.
+TILE_POOL = ThreadPoolExecutor(max_workers=TILE_WORKERS,
+                               thread_name_prefix="tile")
+
+# ---- Neighbor prefetch ----
+# Panning asks for the tiles next to the last one, so a miss also queues
+# its 8 neighbors. They run on a separate, smaller pool with handles of
+# its own, so tiles a client is waiting on never queue behind them. Once
+# PREFETCH_MAX are outstanding, further prefetches are dropped.
+NEIGHBORS = [(dc, dr) for dr in (-1, 0, 1) for dc in (-1, 0, 1) if dc or dr]
+PREFETCH_MAX = 2 * len(NEIGHBORS)
+PREFETCH_POOL = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS,
+                                   thread_name_prefix="prefetch")
+PREFETCH_SLOTS = threading.BoundedSemaphore(PREFETCH_MAX)
+PREFETCH_ENABLED = args.tile_cache_mb > 0 or args.tile_cache_dir is not None
+_prefetching = set()
+
+
+def _prefetch_tile(key):
+    try:
+        reader.prefetch_tile(*key)
+    except Exception as e:
+        print("[viewer] Prefetch of tile {} failed: {}".format(key, e))
+    finally:
+        _prefetching.discard(key)
+        PREFETCH_SLOTS.release()
+
+
+def prefetch_neighbors(level, col, row):
+    # type: (int, int, int) -> None
+    """Queue background reads for the neighbors of a tile that just missed."""
+    for dc, dr in NEIGHBORS:
+        key = (level, col + dc, row + dr)
+        if key in _prefetching or reader.is_tile_cached(key):
+            continue
+        if not PREFETCH_SLOTS.acquire(blocking=False):
+            return
+        _prefetching.add(key)
+        PREFETCH_POOL.submit(_prefetch_tile, key)
+
 
 # ---- WebSocket connection manager ----
 
+class ClientOutbox:
+    """
+    Bounded send queue for one client.
+
+    Messages keep their order. Viewport updates from the same sender
+    coalesce: while one is still waiting to be sent and nothing else from
+    that sender has been queued after it, a newer one replaces its payload
+    in place. So a click between two updates still arrives after the first
+    and before the second. When the queue is full, the oldest entry is
+    dropped.
+    """
+
+    def __init__(self, maxsize):
+        # type: (int) -> None
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        # sender -> [payload, sender] slot of its newest pending update,
+        # only while that update is the newest thing queued from the sender
+        self._latest = {}
+
+    def put(self, payload, sender=None, coalesce=False):
+        # type: (str, object, bool) -> None
+        if coalesce:
+            slot = self._latest.get(sender)
+            if slot is not None:
+                slot[0] = payload
+                return
+            item = [payload, sender]   # slot; payload read on send
+            self._latest[sender] = item
+        else:
+            # Anything queued after the pending update closes it off
+            self._latest.pop(sender, None)
+            item = payload
+
+        if self._queue.full():
+            self._forget(self._queue.get_nowait())
+        self._queue.put_nowait(item)
+
+    async def get(self):
+        # type: () -> str
+        item = await self._queue.get()
+        if isinstance(item, list):
+            self._forget(item)
+            return item[0]
+        return item
+
+    def _forget(self, item):
+        if isinstance(item, list) and self._latest.get(item[1]) is item:
+            del self._latest[item[1]]
+
+
 class ConnectionManager:
+    """
+    Relays messages between WebSocket clients.
+
+    Each client has its own bounded outbox drained by its own sender task,
+    so a slow or stalled client never delays the others.
+    """
+
+    OUTBOX_SIZE = 32
+
+    # Message types where only the newest pending one per sender matters
+    COALESCED_TYPES = frozenset(["viewport_update"])
+
     def __init__(self):
-        self.connections = []          # list of WebSocket
+        self.connections = set()       # set of WebSocket
+        self._outboxes = {}            # WebSocket -> ClientOutbox
+        self._senders = {}             # WebSocket -> asyncio.Task
 
     async def connect(self, ws):
         await ws.accept()
-        self.connections.append(ws)
+        self.connections.add(ws)
+        outbox = ClientOutbox(self.OUTBOX_SIZE)
+        self._outboxes[ws] = outbox
+        self._senders[ws] = asyncio.create_task(self._send_loop(ws, outbox))
         print("[ws] Client connected  (total: {})".format(len(self.connections)))
 
     def disconnect(self, ws):
-        if ws in self.connections:
-            self.connections.remove(ws)
+        if ws not in self.connections:
+            return
+        self.connections.discard(ws)
+        self._outboxes.pop(ws, None)
+        task = self._senders.pop(ws, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
         print("[ws] Client disconnected (total: {})".format(len(self.connections)))
 
-    async def broadcast(self, message, sender=None):
-        """Send to all clients except the sender."""
-        dead = []
+    async def _send_loop(self, ws, outbox):
+        try:
+            while True:
+                payload = await outbox.get()
+                await ws.send_text(payload)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            self.disconnect(ws)
+
+    def broadcast(self, payload, sender=None, msg_type=None):
+        """Queue an already-serialized JSON text frame for every other client."""
+        # Synchronous, so no connect/disconnect can change the set mid-loop
+        coalesce = msg_type in self.COALESCED_TYPES
         for conn in self.connections:
             if conn is sender:
                 continue
-            try:
-                await conn.send_json(message)
-            except Exception:
-                dead.append(conn)
-        for conn in dead:
-            self.disconnect(conn)
+            self._outboxes[conn].put(payload, sender, coalesce)
 
 
 manager = ConnectionManager()
@@ -100,34 +266,75 @@ manager = ConnectionManager()
 
 # ---- Routes ----
 
+# Read once; edits to index.html need a server restart
+with open(os.path.join(STATIC_DIR, "index.html"), "rb") as f:
+    INDEX_HTML = f.read()
+
+
 @app.get("/", response_class=HTMLResponse)
 async def root():
-    path = os.path.join(STATIC_DIR, "index.html")
-    with open(path, "r", encoding="utf-8") as f:
-        return HTMLResponse(f.read())
+    # no-cache: the browser revalidates, so a restart picks up new HTML
+    return HTMLResponse(INDEX_HTML, headers={"Cache-Control": "no-cache"})
 
 
 @app.get("/slide/info")
 async def slide_info():
-    return JSONResponse(reader.get_info())
+    return Response(content=reader.info_json, media_type="application/json")
+
+
+# A tile's bytes never change for a given slide id, and the viewer puts the
+# slide id in tile URLs, so browsers may keep tiles without revalidating
+TILE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def etag_matches(request, etag):
+    # type: (Request, str) -> bool
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag or tag == "*":
+            return True
+    return False
 
 
 @app.get("/tiles/{level}/{col}/{row}.jpeg")
-async def get_tile(level: int, col: int, row: int):
-    try:
-        tile = reader.get_tile(level, col, row)
-    except ValueError:
-        return Response(status_code=404)
-    except Exception as e:
-        return Response(status_code=500, content=str(e))
+async def get_tile(level: int, col: int, row: int, request: Request):
+    headers = {
+        "Cache-Control": TILE_CACHE_CONTROL,
+        "ETag": '"{}-{}-{}-{}"'.format(reader.slide_id, level, col, row),
+    }
+    # Revalidation: the browser already holds these exact bytes
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    # A cache hit is only a dict lookup; just misses go to the worker pool
+    data = reader.get_cached_tile_jpeg((level, col, row))
+    if data is None:
+        # Stored by an earlier run: stream the file as-is
+        path = reader.get_tile_path(level, col, row)
+        if path is not None:
+            return FileResponse(path, media_type="image/jpeg",
+                                headers=headers)
+        try:
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(
+                TILE_POOL, reader.get_tile_jpeg, level, col, row
+            )
+        except ValueError:
+            return Response(status_code=404)
+        except Exception as e:
+            return Response(status_code=500, content=str(e))
+        if PREFETCH_ENABLED:
+            prefetch_neighbors(level, col, row)
 
-    buf = BytesIO()
-    tile.save(buf, format="JPEG", quality=85)
-    buf.seek(0)
     return Response(
-        content=buf.getvalue(),
+        content=data,
         media_type="image/jpeg",
-        headers={"Cache-Control": "public, max-age=3600"},
+        headers=headers,
     )
 
 
@@ -136,9 +343,12 @@ async def websocket_endpoint(ws: WebSocket):
     await manager.connect(ws)
     try:
         while True:
-            data = await ws.receive_json()
-            # Relay to every other connected client
-            await manager.broadcast(data, sender=ws)
+            text = await ws.receive_text()
+            msg = orjson.loads(text)   # rejects malformed frames, as before
+            msg_type = msg.get("type") if isinstance(msg, dict) else None
+            # Relay the original text to every other client; nothing is
+            # re-serialized, per client or at all
+            manager.broadcast(text, sender=ws, msg_type=msg_type)
     except WebSocketDisconnect:
         manager.disconnect(ws)
     except Exception as e:
@@ -156,4 +366,15 @@ app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 if __name__ == "__main__":
     print("[viewer] Starting at http://{}:{}".format(args.host, args.port))
-    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
\ No newline at end of file
+    # One worker on purpose: the WebSocket relay and tile cache live in
+    # this process, so a second worker would split clients into groups
+    # that never see each other's messages.
+    uvicorn.run(
+        app,
+        host=args.host,
+        port=args.port,
+        loop=UVICORN_LOOP,
+        http=UVICORN_HTTP,
+        workers=1,
+        log_level="warning",
+    )
\ No newline at end of file
@@ -64,7 +64,10 @@
                 maxLevel: maxLevel,
                 minLevel: 0,
                 getTileUrl: function (level, x, y) {
-                    return "/tiles/" + level + "/" + x + "/" + y + ".jpeg";
+                    // slide_id versions the URL so tiles can be cached as
+                    // immutable without going stale when the slide changes
+                    return "/tiles/" + level + "/" + x + "/" + y + ".jpeg" +
+                           "?v=" + slideInfo.slide_id;
                 }
             },
             showNavigator:        true,
@@ -268,22 +271,35 @@
     // ---------------------------------------------------------------
 
     function handleIncoming(msg) {
+        var i, now;
+
         if (msg.type === "gaze_point") {
-            gazePoints.push({
-                wsi_x:       msg.wsi_x,
-                wsi_y:       msg.wsi_y,
-                is_saccade:  msg.is_saccade  || false,
-                fixation_id: msg.fixation_id || 0,
-                time:        Date.now()
-            });
-            while (gazePoints.length > MAX_GAZE) {
-                gazePoints.shift();
+            addGazePoint(msg, Date.now());
+        } else if (msg.type === "gaze_batch") {
+            now = Date.now();
+            for (i = 0; i < msg.points.length; i++) {
+                addGazePoint(msg.points[i], now);
             }
         } else if (msg.type === "gaze_clear") {
             gazePoints = [];
+            return;
+        }
+
+        if (gazePoints.length > MAX_GAZE) {
+            gazePoints.splice(0, gazePoints.length - MAX_GAZE);
         }
     }
 
+    function addGazePoint(pt, now) {
+        gazePoints.push({
+            wsi_x:       pt.wsi_x,
+            wsi_y:       pt.wsi_y,
+            is_saccade:  pt.is_saccade  || false,
+            fixation_id: pt.fixation_id || 0,
+            time:        now
+        });
+    }
+
     // ---------------------------------------------------------------
     // Gaze canvas rendering
     // ---------------------------------------------------------------
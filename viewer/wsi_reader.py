@@ -4,14 +4,252 @@ Wrapper around OpenSlide + DeepZoomGenerator for tile-based WSI serving.
 """
 
 import os
+import sys
 import math
+import queue
+import hashlib
+import threading
+from io import BytesIO
+from collections import OrderedDict, namedtuple
+from ctypes import POINTER, c_uint32
 from typing import Dict, List, Optional, Tuple
 
+import numpy as np
+import orjson
 import openslide
-from openslide import OpenSlide, OpenSlideError
+from openslide import OpenSlide, OpenSlideError, lowlevel
 from openslide.deepzoom import DeepZoomGenerator
 from PIL import Image
 
+# libjpeg-turbo's TurboJPEG API encodes straight from the pixel buffer.
+# Optional: needs both PyTurboJPEG and the native libturbojpeg; falls back
+# to Pillow when either is missing.
+try:
+    from turbojpeg import (
+        TurboJPEG, TJPF_RGB, TJPF_RGBX, TJPF_BGRX, TJPF_XRGB, TJSAMP_420,
+    )
+    _turbojpeg = TurboJPEG()   # type: Optional[TurboJPEG]
+except (ImportError, OSError, RuntimeError):
+    _turbojpeg = None
+
+JPEG_ENCODER = "turbojpeg" if _turbojpeg is not None else "Pillow"
+
+# openslide_read_region fills native-endian premultiplied ARGB words. The
+# Python wrapper always converts that to an RGBA PIL image, so opaque
+# tiles are read through the C call directly. Private API: if a future
+# openslide-python drops it, every read goes through read_region().
+_read_region_raw = getattr(lowlevel, "_read_region", None)
+_LITTLE_ENDIAN = sys.byteorder == "little"
+ALPHA_OPAQUE = 0xFF000000
+
+# Optional: tifffile locates the compressed tiles so aligned JPEG tiles can
+# be served without decoding them
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+# Cache charge for a blank tile, whose JPEG is shared: roughly the key
+# tuple plus its slot in the LRU
+BLANK_ENTRY_BYTES = 128
+
+# Overview levels with at most this many tiles are read at startup and
+# pinned in the tile cache
+PIN_MAX_TILES = 64
+
+TIFF_COMPRESSION_JPEG = 7
+TIFF_PHOTOMETRIC_YCBCR = 6
+
+# Raw tile locations for one TIFF page that lines up with a DZ level
+_NativeLevel = namedtuple(
+    "_NativeLevel",
+    "offsets bytecounts tiles_across full_cols full_rows jpeg_tables",
+)
+
+
+def encode_jpeg(tile, quality):
+    # type: (Image.Image, int) -> bytes
+    """
+    Encode an RGB or RGBA tile as baseline 4:2:0 JPEG. Alpha is ignored,
+    as with convert("RGB").
+    """
+    if _turbojpeg is not None:
+        # TurboJPEG reads RGBA directly as RGBX, with no RGB copy
+        return _turbojpeg.encode(
+            np.asarray(tile),
+            quality=quality,
+            pixel_format=TJPF_RGBX if tile.mode == "RGBA" else TJPF_RGB,
+            jpeg_subsample=TJSAMP_420,
+        )
+    if tile.mode != "RGB":
+        tile = tile.convert("RGB")
+    buf = BytesIO()
+    tile.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def encode_jpeg_argb(pixels, quality):
+    # type: (np.ndarray, int) -> bytes
+    """
+    Encode an opaque (h, w) array of native-endian ARGB words, as filled
+    by openslide_read_region, without building an RGBA image first.
+    """
+    h, w = pixels.shape
+    if _turbojpeg is not None:
+        return _turbojpeg.encode(
+            pixels.view(np.uint8).reshape(h, w, 4),
+            quality=quality,
+            pixel_format=TJPF_BGRX if _LITTLE_ENDIAN else TJPF_XRGB,
+            jpeg_subsample=TJSAMP_420,
+        )
+    tile = Image.frombuffer(
+        "RGB", (w, h), pixels, "raw", "BGRX" if _LITTLE_ENDIAN else "XRGB", 0, 1
+    )
+    buf = BytesIO()
+    tile.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+class TileCache:
+    """
+    Thread-safe LRU cache of encoded tiles, bounded by total bytes.
+
+    Keys are (level, col, row). Values are the JPEG bytes that go straight
+    into the HTTP response, so a hit skips both the slide read and the
+    re-encode. An entry whose bytes are shared with other entries (blank
+    tiles) can be charged a smaller size than len(data).
+    """
+
+    def __init__(self, max_bytes):
+        # type: (int) -> None
+        self.max_bytes = max_bytes
+        # key -> (data, charged size)
+        self._items = OrderedDict()   # type: OrderedDict[Tuple[int, int, int], Tuple[bytes, int]]
+        self._size = 0
+        # Outside the LRU and max_bytes: never evicted
+        self._pinned = {}   # type: Dict[Tuple[int, int, int], Tuple[bytes, int]]
+        self._pinned_size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        # type: (Tuple[int, int, int]) -> Optional[bytes]
+        with self._lock:
+            item = self._pinned.get(key)
+            if item is not None:
+                return item[0]
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key, data, size=None):
+        # type: (Tuple[int, int, int], bytes, Optional[int]) -> None
+        if size is None:
+            size = len(data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._items[key] = (data, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._size -= evicted
+
+    def pin(self, key, data):
+        # type: (Tuple[int, int, int], bytes) -> None
+        """Keep an entry for good, moving it out of the LRU if present."""
+        with self._lock:
+            size = len(data)
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+                size = old[1]
+            old = self._pinned.get(key)
+            if old is not None:
+                self._pinned_size -= old[1]
+            self._pinned[key] = (data, size)
+            self._pinned_size += size
+
+    def __contains__(self, key):
+        # type: (Tuple[int, int, int]) -> bool
+        # Membership only; unlike get(), doesn't count as a use
+        return key in self._pinned or key in self._items
+
+    def __len__(self):
+        # type: () -> int
+        return len(self._pinned) + len(self._items)
+
+    @property
+    def size_bytes(self):
+        # type: () -> int
+        return self._size
+
+    @property
+    def pinned_bytes(self):
+        # type: () -> int
+        return self._pinned_size
+
+
+def slide_tile_id(slide_path, tile_size, overlap, jpeg_quality):
+    # type: (str, int, int, int) -> str
+    """
+    Short id for the tiles this server produces for a slide: a hash of
+    the slide's path, size and mtime and the tile settings. Anything that
+    could change a tile's bytes changes the id.
+    """
+    st = os.stat(slide_path)
+    key = "{}|{}|{}|{}|{}|{}".format(
+        os.path.abspath(slide_path), st.st_size, st.st_mtime_ns,
+        tile_size, overlap, jpeg_quality,
+    )
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+class DiskTileCache:
+    """
+    Encoded tiles on disk, so a restart serves them without re-reading
+    the slide. Layout: <root>/<slide name>_<slide id>/<level>/<col>_<row>.jpg
+
+    The slide id changes with the slide file or tile settings (see
+    slide_tile_id), so those get a fresh directory.
+    """
+
+    def __init__(self, root, slide_path, slide_id):
+        # type: (str, str, str) -> None
+        name = os.path.splitext(os.path.basename(slide_path))[0]
+        self.directory = os.path.join(root, "{}_{}".format(name, slide_id))
+        self._made_dirs = set()
+
+    def path(self, key):
+        # type: (Tuple[int, int, int]) -> str
+        level, col, row = key
+        return os.path.join(self.directory, str(level),
+                            "{}_{}.jpg".format(col, row))
+
+    def get_path(self, key):
+        # type: (Tuple[int, int, int]) -> Optional[str]
+        """Path of the stored tile, or None if it has not been written."""
+        path = self.path(key)
+        return path if os.path.isfile(path) else None
+
+    def put(self, key, data):
+        # type: (Tuple[int, int, int], bytes) -> None
+        path = self.path(key)
+        folder = os.path.dirname(path)
+        if folder not in self._made_dirs:
+            os.makedirs(folder, exist_ok=True)
+            self._made_dirs.add(folder)
+        # Write beside the target, then rename, so readers never see a
+        # partial file
+        tmp = "{}.{}-{}.tmp".format(path, os.getpid(), threading.get_ident())
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
 
 class WSIReader:
     """
@@ -25,14 +263,29 @@ class WSIReader:
         is zero or negligible.
     """
 
-    def __init__(self, slide_path, tile_size=256, overlap=0):
-        # type: (str, int, int) -> None
+    def __init__(self, slide_path, tile_size=256, overlap=0,
+                 tile_cache_mb=128, jpeg_quality=85, handles=1,
+                 tile_cache_dir=None):
+        # type: (str, int, int, int, int, int, Optional[str]) -> None
         if not os.path.isfile(slide_path):
             raise FileNotFoundError("Slide not found: {}".format(slide_path))
 
         self.slide_path = slide_path
         self.tile_size = tile_size
         self.overlap = overlap
+        self.jpeg_quality = jpeg_quality
+        self.slide_id = slide_tile_id(slide_path, tile_size, overlap, jpeg_quality)
+        self.tile_cache = TileCache(tile_cache_mb * 1024 * 1024)
+        self.disk_cache = None   # type: Optional[DiskTileCache]
+        if tile_cache_dir:
+            self.disk_cache = DiskTileCache(tile_cache_dir, slide_path,
+                                            self.slide_id)
+
+        # Tiles that came back as one flat color (background outside the
+        # tissue) share a single encoded JPEG per size and color. They are
+        # cached in tile_cache at BLANK_ENTRY_BYTES each, so they stay
+        # bounded by it and are off with it.
+        self._blank_jpegs = {}   # type: Dict[tuple, bytes]
 
         self.slide = OpenSlide(slide_path)
         self.dz = DeepZoomGenerator(
@@ -42,9 +295,76 @@ class WSIReader:
             limit_bounds=True,
         )
 
+        # Independent OpenSlide handles for tile reads, so concurrent
+        # requests don't queue on one handle's lock. The first is the
+        # handle above, which also serves metadata.
+        self._handles = queue.Queue()
+        self._handles.put(self.slide)
+        for _ in range(max(handles, 1) - 1):
+            self._handles.put(OpenSlide(slide_path))
+        self.handle_count = max(handles, 1)
+
+        # read_region() arguments for every tile, from DeepZoom's own math
+        self._tile_map = self._build_tile_map()
+        self._bg_color = "#" + self.slide.properties.get(
+            openslide.PROPERTY_NAME_BACKGROUND_COLOR, "ffffff"
+        )
+        # Per-thread ARGB read buffer, sized for the largest tile
+        self._raw_local = threading.local()
+        self._raw_words = (tile_size + 2 * overlap) ** 2
+
+        # DZ level -> _NativeLevel, for levels served straight from the file
+        self._native_levels = self._find_native_levels()
+        self._raw_file = open(slide_path, "rb") if self._native_levels else None
+        self._raw_lock = threading.Lock()
+
+        # Constants for the magnification helpers
+        obj_str = self.slide.properties.get(openslide.PROPERTY_NAME_OBJECTIVE_POWER)
+        self._objective = float(obj_str) if obj_str is not None else None
+        self._log2_objective = (math.log2(self._objective)
+                                if self._objective else None)
+        self._max_level = self.dz.level_count - 1
+
+        # Slide metadata never changes; build it and its JSON once
+        self._info = self._build_info()
+        self.info_json = orjson.dumps(self._info)
+
+    def _build_tile_map(self):
+        # type: () -> List[Tuple[int, list, list]]
+        """
+        Per DZ level: (slide level, column spans, row spans).
+
+        DeepZoom's tile geometry is separable: a tile's x position, read
+        width and output width depend only on its column, and likewise
+        for rows. So each axis is tabulated once as (level-0 offset, read
+        size, output size) per index, and a tile lookup is two list
+        indexings instead of DeepZoomGenerator's per-call arithmetic.
+        """
+        dz = self.dz
+        tile_map = []
+        for level in range(dz.level_count):
+            tiles_x, tiles_y = dz.level_tiles[level]
+            cols = []
+            for col in range(tiles_x):
+                (l0_x, _), slide_level, (l_w, _) = dz.get_tile_coordinates(level, (col, 0))
+                cols.append((l0_x, l_w, dz.get_tile_dimensions(level, (col, 0))[0]))
+            rows = []
+            for row in range(tiles_y):
+                (_, l0_y), slide_level, (_, l_h) = dz.get_tile_coordinates(level, (0, row))
+                rows.append((l0_y, l_h, dz.get_tile_dimensions(level, (0, row))[1]))
+            tile_map.append((slide_level, cols, rows))
+        return tile_map
+
     def get_info(self):
         # type: () -> Dict
-        """Return slide metadata as a JSON-serializable dictionary."""
+        """
+        Return slide metadata as a JSON-serializable dictionary.
+        The dict is shared; callers must not modify it.
+        """
+        return self._info
+
+    def _build_info(self):
+        # type: () -> Dict
         props = self.slide.properties
 
         objective_power = props.get(openslide.PROPERTY_NAME_OBJECTIVE_POWER)
@@ -58,6 +378,8 @@ class WSIReader:
 
         return {
             "filename": os.path.basename(self.slide_path),
+            # Changes whenever tile bytes could; versions tile URLs
+            "slide_id": self.slide_id,
             # Full level-0 slide dimensions
             "slide_dimensions": list(self.slide.dimensions),
             # OpenSlide pyramid info
@@ -86,6 +408,16 @@ class WSIReader:
         Get a single tile as a PIL Image.
         Raises ValueError if coordinates are out of range.
         """
+        tile = self._read_tile(level, col, row)
+
+        # Ensure RGB (some formats return RGBA)
+        if tile.mode != "RGB":
+            tile = tile.convert("RGB")
+
+        return tile
+
+    def _check_tile(self, level, col, row):
+        # type: (int, int, int) -> None
         if level < 0 or level >= self.dz.level_count:
             raise ValueError(
                 "Level {} out of range [0, {})".format(level, self.dz.level_count)
@@ -99,47 +431,316 @@ class WSIReader:
                 )
             )
 
-        tile = self.dz.get_tile(level, (col, row))
+    def _read_tile(self, level, col, row):
+        # type: (int, int, int) -> Image.Image
+        """Read a tile as DeepZoom would, without DeepZoomGenerator.get_tile."""
+        self._check_tile(level, col, row)
+        slide_level, cols, rows = self._tile_map[level]
+        l0_x, l_w, z_w = cols[col]
+        l0_y, l_h, z_h = rows[row]
 
-        # Ensure RGB (some formats return RGBA)
-        if tile.mode != "RGB":
-            tile = tile.convert("RGB")
+        slide = self._handles.get()
+        try:
+            tile = slide.read_region((l0_x, l0_y), slide_level, (l_w, l_h))
+        finally:
+            self._handles.put(slide)
 
+        # Same finishing as DeepZoomGenerator.get_tile: flatten onto the
+        # slide background, then scale if the slide level didn't match
+        profile = tile.info.get("icc_profile")
+        bg = Image.new("RGB", tile.size, self._bg_color)
+        tile = Image.composite(tile, bg, tile)
+        if tile.size != (z_w, z_h):
+            tile.thumbnail((z_w, z_h), getattr(Image, "Resampling", Image).LANCZOS)
+        if profile is not None:
+            tile.info["icc_profile"] = profile
         return tile
 
+    def _read_tile_argb(self, level, col, row):
+        # type: (int, int, int) -> Optional[np.ndarray]
+        """
+        Read a tile into this thread's buffer as (h, w) ARGB words, or
+        return None if it needs _read_tile's finishing: a slide level that
+        must be downscaled, or any transparent pixel. Otherwise the
+        background composite is a no-op and the words can be encoded as
+        they are. The array is only valid until the thread's next read.
+        """
+        if _read_region_raw is None:
+            return None
+        self._check_tile(level, col, row)
+        slide_level, cols, rows = self._tile_map[level]
+        l0_x, l_w, z_w = cols[col]
+        l0_y, l_h, z_h = rows[row]
+        if (l_w, l_h) != (z_w, z_h):
+            return None
+
+        buf = getattr(self._raw_local, "buf", None)
+        if buf is None:
+            buf = np.empty(self._raw_words, dtype=np.uint32)
+            self._raw_local.buf = buf
+        pixels = buf[:l_w * l_h]
+
+        slide = self._handles.get()
+        try:
+            _read_region_raw(
+                slide._osr, pixels.ctypes.data_as(POINTER(c_uint32)),
+                l0_x, l0_y, slide_level, l_w, l_h,
+            )
+        finally:
+            self._handles.put(slide)
+
+        # Premultiplied, so opaque means every alpha byte is 0xFF
+        if pixels.min() < ALPHA_OPAQUE:
+            return None
+        return pixels.reshape(l_h, l_w)
+
+    def get_tile_jpeg(self, level, col, row):
+        # type: (int, int, int) -> bytes
+        """
+        Get a single tile as JPEG bytes, from the tile cache when possible.
+        Raises ValueError if coordinates are out of range.
+        """
+        key = (level, col, row)
+        data = self.get_cached_tile_jpeg(key)
+        if data is not None:
+            return data
+
+        data = self.get_native_jpeg(level, col, row)
+        if data is None:
+            pixels = self._read_tile_argb(level, col, row)
+            if pixels is not None:
+                data = self._blank_jpeg_argb(pixels)
+            else:
+                tile = self._read_tile(level, col, row)
+                data = self._blank_jpeg(tile)
+            if data is not None:
+                self.tile_cache.put(key, data, BLANK_ENTRY_BYTES)
+                return data
+            if pixels is not None:
+                data = encode_jpeg_argb(pixels, self.jpeg_quality)
+            else:
+                data = encode_jpeg(tile, self.jpeg_quality)
+        self.tile_cache.put(key, data)
+        if self.disk_cache is not None:
+            try:
+                self.disk_cache.put(key, data)
+            except OSError as e:
+                print("[viewer] Tile cache write failed: {}".format(e))
+        return data
+
+    def prefetch_tile(self, level, col, row):
+        # type: (int, int, int) -> bool
+        """
+        Encode and cache a tile ahead of its request. Returns False, with
+        no slide read, if the tile is out of range or already stored.
+        """
+        try:
+            self._check_tile(level, col, row)
+        except ValueError:
+            return False
+        if (self.is_tile_cached((level, col, row))
+                or self.get_tile_path(level, col, row) is not None):
+            return False
+        self.get_tile_jpeg(level, col, row)
+        return True
+
+    def is_tile_cached(self, key):
+        # type: (Tuple[int, int, int]) -> bool
+        """True if the tile's JPEG is held in memory."""
+        return key in self.tile_cache
+
+    def get_tile_path(self, level, col, row):
+        # type: (int, int, int) -> Optional[str]
+        """Path of the tile in the disk cache, if it has been stored."""
+        if self.disk_cache is None:
+            return None
+        return self.disk_cache.get_path((level, col, row))
+
+    def get_cached_tile_jpeg(self, key):
+        # type: (Tuple[int, int, int]) -> Optional[bytes]
+        """Return a tile's JPEG if already known, without touching the slide."""
+        return self.tile_cache.get(key)
+
+    def _blank_jpeg(self, tile):
+        # type: (Image.Image) -> Optional[bytes]
+        """
+        If the tile is a single flat color, return the shared JPEG for
+        that size and color (encoded on first use), else None.
+        """
+        extrema = tile.getextrema()
+        if any(lo != hi for lo, hi in extrema[:3]):
+            return None
+        if len(extrema) > 3 and extrema[3] != (255, 255):
+            return None   # transparent; leave it to the normal path
+
+        return self._blank_jpeg_for(tile.size, tuple(lo for lo, _ in extrema[:3]))
+
+    def _blank_jpeg_argb(self, pixels):
+        # type: (np.ndarray) -> Optional[bytes]
+        """_blank_jpeg for an opaque array from _read_tile_argb."""
+        word = int(pixels.flat[0])
+        if not (pixels == word).all():
+            return None
+        h, w = pixels.shape
+        color = ((word >> 16) & 0xFF, (word >> 8) & 0xFF, word & 0xFF)
+        return self._blank_jpeg_for((w, h), color)
+
+    def _blank_jpeg_for(self, size, color):
+        # type: (Tuple[int, int], Tuple[int, ...]) -> bytes
+        blank_key = (size, color)
+        data = self._blank_jpegs.get(blank_key)
+        if data is None:
+            data = encode_jpeg(Image.new("RGB", size, color), self.jpeg_quality)
+            self._blank_jpegs[blank_key] = data
+        return data
+
+    @property
+    def pinned_levels(self):
+        # type: () -> List[int]
+        """DZ levels small enough for pin_overview_tiles (PIN_MAX_TILES)."""
+        levels = []
+        for level, (tiles_x, tiles_y) in enumerate(self.dz.level_tiles):
+            if tiles_x * tiles_y > PIN_MAX_TILES:
+                break
+            levels.append(level)
+        return levels
+
+    def pin_overview_tiles(self):
+        # type: () -> int
+        """
+        Read every tile of pinned_levels into the tile cache, pinned so
+        eviction never drops them. Each covers a large area of the slide
+        for one small JPEG, which makes them the dearest tiles to produce
+        on demand. Returns the number of tiles pinned.
+        """
+        count = 0
+        for level in self.pinned_levels:
+            tiles_x, tiles_y = self.dz.level_tiles[level]
+            for row in range(tiles_y):
+                for col in range(tiles_x):
+                    data = self.get_tile_jpeg(level, col, row)
+                    self.tile_cache.pin((level, col, row), data)
+                    count += 1
+        return count
+
+    @property
+    def native_levels(self):
+        # type: () -> List[int]
+        """DZ levels whose interior tiles are served without re-encoding."""
+        return sorted(self._native_levels)
+
+    def _find_native_levels(self):
+        # type: () -> Dict[int, _NativeLevel]
+        """
+        Match DZ levels to JPEG-tiled TIFF pages on the same tile grid.
+
+        A DZ tile equals a stored TIFF tile only if there is no overlap and
+        no bounds offset, the slide level has exactly the DZ level's
+        downsample and size, and the page uses tile_size tiles. The page
+        must also be YCbCr JPEG, because RGB-JPEG tiles (e.g. Aperio
+        "JPEG/RGB") are not decoded correctly as standalone JPEG files.
+        """
+        if tifffile is None or self.overlap != 0:
+            return {}
+
+        max_level = self.dz.level_count - 1
+        if tuple(self.dz.level_dimensions[max_level]) != tuple(self.slide.dimensions):
+            return {}   # limit_bounds cropped the slide; grids are offset
+
+        try:
+            tif = tifffile.TiffFile(self.slide_path)
+        except Exception:
+            return {}
+
+        levels = {}
+        with tif:
+            pages = [p for p in tif.pages if p.is_tiled]
+            for k, (w, h) in enumerate(self.slide.level_dimensions):
+                steps = math.log2(self.slide.level_downsamples[k])
+                if steps != int(steps):
+                    continue
+                dz_level = max_level - int(steps)
+                if dz_level < 0 or tuple(self.dz.level_dimensions[dz_level]) != (w, h):
+                    continue
+
+                page = next((p for p in pages
+                             if (p.imagewidth, p.imagelength) == (w, h)), None)
+                if (page is None
+                        or page.compression != TIFF_COMPRESSION_JPEG
+                        or page.photometric != TIFF_PHOTOMETRIC_YCBCR
+                        or page.samplesperpixel != 3
+                        or page.planarconfig != 1
+                        or page.tilewidth != self.tile_size
+                        or page.tilelength != self.tile_size):
+                    continue
+
+                levels[dz_level] = _NativeLevel(
+                    offsets=page.dataoffsets,
+                    bytecounts=page.databytecounts,
+                    tiles_across=-(-w // self.tile_size),
+                    full_cols=w // self.tile_size,
+                    full_rows=h // self.tile_size,
+                    jpeg_tables=page.jpegtables,
+                )
+        return levels
+
+    def get_native_jpeg(self, level, col, row):
+        # type: (int, int, int) -> Optional[bytes]
+        """
+        Return the stored JPEG for a tile when it can be served as-is,
+        else None. Edge tiles are always None: DZ crops them, but the TIFF
+        stores them padded to the full tile size.
+        """
+        native = self._native_levels.get(level)
+        if native is None or col >= native.full_cols or row >= native.full_rows:
+            return None
+        if col < 0 or row < 0:
+            return None
+
+        idx = row * native.tiles_across + col
+        count = native.bytecounts[idx]
+        if count == 0:
+            return None   # sparse tile; let OpenSlide fill it in
+
+        with self._raw_lock:
+            self._raw_file.seek(native.offsets[idx])
+            data = self._raw_file.read(count)
+
+        if native.jpeg_tables:
+            # Abbreviated stream: splice the shared tables in after SOI,
+            # dropping the tables' EOI and the tile's SOI
+            data = native.jpeg_tables[:-2] + data[2:]
+        return data
+
     def get_magnification_at_dz_level(self, dz_level):
         # type: (int) -> Optional[float]
         """Calculate effective magnification at a given DZ level."""
-        obj_str = self.slide.properties.get(openslide.PROPERTY_NAME_OBJECTIVE_POWER)
-        if obj_str is None:
+        if self._objective is None:
             return None
 
-        objective = float(obj_str)
-        max_level = self.dz.level_count - 1
-        downsample = 2.0 ** (max_level - dz_level)
-        return objective / downsample
+        downsample = 2.0 ** (self._max_level - dz_level)
+        return self._objective / downsample
 
     def get_dz_level_for_magnification(self, target_mag):
         # type: (float) -> Optional[int]
         """Find the DeepZoom level closest to a target magnification."""
-        obj_str = self.slide.properties.get(openslide.PROPERTY_NAME_OBJECTIVE_POWER)
-        if obj_str is None:
+        if self._objective is None:
             return None
 
-        objective = float(obj_str)
-        max_level = self.dz.level_count - 1
-
+        max_level = self._max_level
         if target_mag <= 0:
             return 0
-        if target_mag >= objective:
+        if target_mag >= self._objective:
             return max_level
 
-        ratio = objective / target_mag
-        diff = math.log2(ratio)
+        diff = self._log2_objective - math.log2(target_mag)
         dz_level = int(round(max_level - diff))
         return max(0, min(max_level, dz_level))
 
     def close(self):
         # type: () -> None
-        """Release the OpenSlide handle."""
-        self.slide.close()
\ No newline at end of file
+        """Release the OpenSlide handles."""
+        for _ in range(self.handle_count):
+            self._handles.get().close()
+        if self._raw_file is not None:
+            self._raw_file.close()
\ No newline at end of file